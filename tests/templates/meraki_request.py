@@ -4,6 +4,7 @@ import os
 import urllib.parse
 from robot.api import logger
 import time, random, json
+import contextlib
 
 # Code ported from https://github.com/meraki/dashboard-api-python/releases/tag/2.0.2
 # Python SDK release 2.0.2
@@ -19,8 +20,10 @@ RETRY_4XX_ERROR = False
 RETRY_4XX_ERROR_WAIT_TIME = 1
 
 # To catch exceptions while making API calls (ported from Meraki Python SDK)
+# content is the already read response body, if any,
+# so that the message is built without reading the response again.
 class APIError(Exception):
-    def __init__(self, response):
+    def __init__(self, response, content=None):
         self.response = response
         self.status = (
             self.response.status_code
@@ -33,13 +36,18 @@ class APIError(Exception):
             else None
         )
         try:
-            self.message = (
-                self.response.json()
-                if self.response is not None and self.response.json()
-                else None
-            )
+            if content is not None:
+                self.message = json.loads(content) if content.strip() else None
+            else:
+                self.message = (
+                    self.response.json()
+                    if self.response is not None and self.response.json()
+                    else None
+                )
         except ValueError:
-            self.message = self.response.content[:100].decode("UTF-8").strip()
+            if content is None:
+                content = self.response.content
+            self.message = content[:100].decode("UTF-8", errors="replace").strip()
             if (
                 type(self.message) == str
                 and self.status == 404
@@ -79,7 +87,27 @@ def request_session(api_key=None):
         }
     return session
 
+# Decode a raw JSON body (bytes). Return None for an empty body.
+def decode_json(raw):
+    return json.loads(raw) if raw.strip() else None
+
+# Open a private temporary file for writing and rename it to path on success,
+# so concurrent readers (e.g. other Pabot workers) never see a partial file.
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 # Request with API error handling (ported from Meraki Python SDK)
+# For GET, the body is read and decoded once; the raw bytes are available
+# as response.body and the decoded JSON as response.data.
 def request(req_session, method, url, **kwargs):
     base_url = API_BASE
 
@@ -130,16 +158,27 @@ def request(req_session, method, url, **kwargs):
         elif response.ok:
             logger.info(f'{method}, {abs_url} - {status} {reason}')
             # For non-empty response to GET, ensure valid JSON
+            body = None
             try:
-                if method == 'GET' and response.content.strip():
-                    response.json()
+                if method == 'GET':
+                    # Reading the body may still fail if the caller passed stream=True
+                    body = response.content
+                    response.body, response.data = body, decode_json(body)
                 return response
-            except json.decoder.JSONDecodeError as e:
+            except requests.exceptions.RequestException as e:
                 logger.info(f'{method}, {abs_url} - {e}, retrying in 1 second')
                 time.sleep(1)
                 retries -= 1
                 if retries == 0:
-                    raise APIError(response)
+                    raise Exception(f'Request failed for {method} {abs_url} - {e}')
+                else:
+                    continue
+            except ValueError as e:
+                logger.info(f'{method}, {abs_url} - {e}, retrying in 1 second')
+                time.sleep(1)
+                retries -= 1
+                if retries == 0:
+                    raise APIError(response, content=body)
                 else:
                     continue
 
@@ -0,0 +1,289 @@
+# meraki_snapshot.py
+"""
+Snapshot of Meraki API responses for offline validation.
+
+The snapshot command crawls every organization's networks, devices
+and the child endpoints used by the Robot templates once,
+and stores the raw response bodies in a single indexed file.
+With MERAKI_SNAPSHOT=<file> set, Get Meraki Data and Map Names To Ids
+read from that file instead of the API (see myutils._get_request_caching),
+so the test suite can run on all cores without any API calls.
+
+    python tests/templates/meraki_snapshot.py -o snapshot.mrks
+
+URLs answering 400 or 404 (endpoints not applicable to a network,
+e.g. appliance settings of a network without an appliance) are recorded
+as skipped; any other API error aborts the snapshot.
+
+File layout: MAGIC, zlib-compressed bodies, zlib-compressed JSON index
+({"created", "organizations", "entries": {url: [offset, length]},
+"skipped": {url: status}}),
+8-byte little-endian index length, MAGIC.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+
+from meraki_request import API_BASE, APIError, atomic_write, decode_json, request_session, request
+
+# Constants
+SNAPSHOT_MAGIC = b"MRKSNAP1"
+SNAPSHOT_ENVIRONMENT_VARIABLE = "MERAKI_SNAPSHOT"
+_FOOTER = struct.Struct("<Q")
+# Statuses meaning "endpoint not applicable", recorded as skipped
+SKIPPED_STATUSES = (400, 404)
+# Matches API URL templates used as keyword arguments in the Robot templates
+ENDPOINT_REGEX = r"(?<![\w/])/(?:organizations|networks|devices)/\{[a-zA-Z]*\}[^\s'\"]*"
+
+class SnapshotError(Exception):
+    pass
+
+class Snapshot:
+    """
+    Read-only access to a snapshot file.
+    Only the index is loaded on open; bodies are read and decoded on demand.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.file = open(path, "rb")
+        except OSError as e:
+            raise SnapshotError(f"Cannot open snapshot {path}: {e}")
+        try:
+            index = self._read_index()
+            self.created = index["created"]
+            self.organizations = index["organizations"]
+            self.entries = index["entries"]
+            self.skipped = index["skipped"]
+        except (OSError, ValueError, KeyError, TypeError, struct.error, zlib.error) as e:
+            self.file.close()
+            raise SnapshotError(f"{path} is not a valid Meraki snapshot: {e}")
+        except SnapshotError:
+            self.file.close()
+            raise
+
+    def _read_index(self):
+        footer_size = _FOOTER.size + len(SNAPSHOT_MAGIC)
+        size = os.fstat(self.file.fileno()).st_size
+        if size < len(SNAPSHOT_MAGIC) + footer_size \
+                or self.file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise SnapshotError(f"{self.path} is not a Meraki snapshot")
+        self.file.seek(size - footer_size)
+        index_length, = _FOOTER.unpack(self.file.read(_FOOTER.size))
+        if self.file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC \
+                or index_length > size - len(SNAPSHOT_MAGIC) - footer_size:
+            raise SnapshotError(f"{self.path} is truncated")
+        self.file.seek(size - footer_size - index_length)
+        return json.loads(zlib.decompress(self.file.read(index_length)))
+
+    def __contains__(self, url):
+        return url in self.entries
+
+    def get_raw(self, url):
+        """Return the raw response body for url."""
+
+        offset, length = self.entries[url]
+        self.file.seek(offset)
+        return zlib.decompress(self.file.read(length))
+
+    def get(self, url):
+        """Return the decoded response for url. Raise KeyError if url was not captured."""
+
+        return decode_json(self.get_raw(url))
+
+    def close(self):
+        self.file.close()
+
+class SnapshotWriter:
+    """
+    Write a snapshot to an open binary file. Bodies are appended as they are added,
+    so memory use does not grow with the size of the organization.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.file.write(SNAPSHOT_MAGIC)
+        self.entries = {}
+        self.skipped = {}
+        self.organizations = []
+
+    def add(self, url, body):
+        """Add the raw response body (bytes) for url."""
+
+        compressed = zlib.compress(body)
+        self.entries[url] = [self.file.tell(), len(compressed)]
+        self.file.write(compressed)
+
+    def skip(self, url, status):
+        """Record that url was not applicable (answered with status)."""
+
+        self.skipped[url] = status
+
+    def get(self, url):
+        """Return the decoded body added for url (file must be opened for reading too)."""
+
+        offset, length = self.entries[url]
+        end = self.file.tell()
+        self.file.seek(offset)
+        raw = zlib.decompress(self.file.read(length))
+        self.file.seek(end)
+        return decode_json(raw)
+
+    def finish(self):
+        """Write the index and footer. No bodies can be added afterwards."""
+
+        index = zlib.compress(json.dumps({
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "organizations": self.organizations,
+            "entries": self.entries,
+            "skipped": self.skipped,
+        }).encode())
+        self.file.write(index)
+        self.file.write(_FOOTER.pack(len(index)))
+        self.file.write(SNAPSHOT_MAGIC)
+
+def find_endpoints(templates_dir):
+    """Return the sorted API URL templates referenced by the .robot files under templates_dir."""
+
+    endpoints = set()
+    for path in glob.glob(os.path.join(templates_dir, "**", "*.robot"), recursive=True):
+        with open(path, "r") as f:
+            endpoints.update(re.findall(ENDPOINT_REGEX, f.read()))
+    return sorted(endpoints)
+
+class _Crawler:
+    """
+    Fetch every URL that myutils._get_meraki_data would request
+    for the given endpoints, for every network or device of each organization.
+    """
+
+    def __init__(self, session, writer):
+        # Imported here, as myutils itself reads snapshots through this module.
+        import myutils
+        self.myutils = myutils
+        self.session = session
+        self.writer = writer
+        # Decoded list responses of the current organization
+        # that are walked down to child resources, by url
+        self.data = {}
+
+    def get(self, url, walk=False):
+        """
+        Fetch url into the snapshot once. Return its decoded response
+        if walk is True (for walking down to child resources), else None.
+        """
+
+        url = url.strip("/")
+        if url in self.data:
+            return self.data[url]
+        if url in self.writer.skipped:
+            return None
+        if url in self.writer.entries:
+            if not walk:
+                return None
+            self.data[url] = self.writer.get(url)
+            return self.data[url]
+        self.myutils.throttle_request()
+        try:
+            r = request(self.session, "GET", url)
+        except APIError as e:
+            if e.status not in SKIPPED_STATUSES:
+                raise
+            print(f"Skipping {url}: {e}", file=sys.stderr)
+            self.writer.skip(url, e.status)
+            return None
+        self.writer.add(url, r.body)
+        if not walk:
+            return None
+        self.data[url] = r.data
+        return r.data
+
+    def crawl(self, endpoints, org_names=None):
+        orgs = self.get(API_BASE + "/organizations", walk=True) or []
+        self.data = {}
+        for org in orgs:
+            if org_names and org["name"] not in org_names:
+                continue
+            self.writer.organizations.append(org["name"])
+            org_url = f"{API_BASE}/organizations/{org['id']}"
+            self.get(org_url + "/networks")
+            self.get(org_url + "/devices")
+            for endpoint in endpoints:
+                self.crawl_endpoint(endpoint, org_url)
+            # Drop per-organization data that is no longer needed.
+            self.data = {}
+        missing = sorted(set(org_names or []) - set(self.writer.organizations))
+        if missing:
+            raise SnapshotError(f"Organizations not found: {', '.join(missing)}")
+
+    def crawl_endpoint(self, endpoint, org_url):
+        possible_ids = self.myutils._possible_id_props_from_url(endpoint)
+        api_path = [p.strip("/") for p in re.split(self.myutils.API_PATH_ID_REGEX, endpoint)]
+        if api_path[0] == "organizations":
+            self.crawl_children(api_path[1:], org_url, possible_ids)
+            return
+        top_resource_id_name = "serial" if api_path[0] == "devices" else "id"
+        for t in self.get(f"{org_url}/{api_path[0]}", walk=True) or []:
+            top_url = f"{API_BASE}/{api_path[0]}/{t[top_resource_id_name]}"
+            self.crawl_children(api_path[1:], top_url, possible_ids)
+            if endpoint == "/networks/{networkId}/switch/stp":
+                self.get(top_url + "/switch/stacks")
+
+    def crawl_children(self, api_path, url_acc, possible_ids):
+        url_acc += "/" + api_path[0]
+        if len(api_path) == 1:
+            self.get(url_acc)
+            return
+        resources = self.get(url_acc, walk=True)
+        if not isinstance(resources, list):
+            return
+        for r in resources:
+            try:
+                resource_id = self.myutils._get_resource_id(r, possible_ids)
+            except Exception:
+                continue
+            self.crawl_children(api_path[1:], url_acc + "/" + resource_id, possible_ids)
+
+def create_snapshot(path, endpoints, org_names=None, api_key=None):
+    """
+    Crawl the API for endpoints in the organizations named org_names
+    (all accessible organizations if None) and write the snapshot to path.
+    Raise SnapshotError, writing no file, if any of org_names is not found.
+    """
+
+    session = request_session(api_key)
+    # Opened for reading too, to read back bodies that are walked again.
+    with atomic_write(path, "w+b") as f:
+        writer = SnapshotWriter(f)
+        _Crawler(session, writer).crawl(endpoints, org_names)
+        writer.finish()
+    return writer
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Capture a snapshot of Meraki API data for offline tests.")
+    parser.add_argument("-o", "--output", required=True, help="snapshot file to write")
+    parser.add_argument("--org", action="append", dest="orgs", help="organization name (repeatable, default: all)")
+    parser.add_argument("-t", "--templates", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory with .robot templates to take endpoints from")
+    parser.add_argument("-e", "--endpoint", action="append", dest="endpoints",
+                        help="API URL template to capture (repeatable, default: taken from templates)")
+    args = parser.parse_args(argv)
+
+    endpoints = args.endpoints or find_endpoints(args.templates)
+    try:
+        writer = create_snapshot(args.output, endpoints, args.orgs)
+    except SnapshotError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Wrote {len(writer.entries)} responses for {len(writer.organizations)} organizations to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,15 +6,18 @@ from robot.libraries.BuiltIn import BuiltIn
 import fcntl
 import os
 import random
+import hashlib
+import shutil
 from meraki_request import (
     request_session, request, APIError, APIKeyError,
+    decode_json, atomic_write,
 )
+from meraki_snapshot import Snapshot, SNAPSHOT_ENVIRONMENT_VARIABLE
 
 # Constants
 API_PATH_ID_REGEX = r'{[a-zA-Z]*}'
 API_BASE = "https://api.meraki.com/api/v1"
-CACHE_FILE = "cache.json"
-LOCK_FILE = "cache.json.lock"
+CACHE_DIR = "cache"
 THROTTLE_LOCK_FILE = "meraki_api_throttle.lock"
 THROTTLE_SLEEP_SECONDS = 0.1  # Meraki limit = 10 req/sec
 
@@ -156,9 +159,9 @@ def unflatten_dicts(data, add_key):
 
     return {add_key: data}
 
-def unflatten_dicts_in_property(data, prop, add_key):
+def unflatten_dicts_in_property(data, prop, add_key, path=""):
     """
-    Return data with its prop key's value replaced
+    Return data (at path) with its prop key's value replaced
     with a single-item dict with add_key as the key.
     If data is a list, transform each item's prop key.
     If the prop key's value is a list,
@@ -180,15 +183,17 @@ def unflatten_dicts_in_property(data, prop, add_key):
     to correlate individual resources with the YAML counterparts).
     """
 
-    # TODO Allow property to be a path like prop1.prop2 when that becomes needed.
+    return apply_transforms(data, [_unflatten_dicts_in_property_transform(prop, add_key, path)])
 
-    if isinstance(data, list):
-        return [unflatten_dicts_in_property(i, prop, add_key) for i in data]
+def _unflatten_dicts_in_property_transform(prop, add_key, path=""):
+    return (path, lambda data: _unflatten_dict_in_property(data, prop, add_key))
 
-    return {
-        k: unflatten_dicts(v, add_key) if k == prop else v
-        for k, v in data.items()
-    }
+def _unflatten_dict_in_property(data, prop, add_key):
+    if not isinstance(data, dict) or prop not in data:
+        return data
+    new_data = data.copy()
+    new_data[prop] = unflatten_dicts(data[prop], add_key)
+    return new_data
 
 def get_list_item_by_key(l, key, value):
     """
@@ -255,41 +260,53 @@ def _delete_cache():
     # Note: this doesn't handle locking,
     #       but that's fine since this should only be used
     #       with Pabot's "Run Setup Only Once" in the top-level Robot suite setup.
-    if os.path.exists(CACHE_FILE):
-        os.remove(CACHE_FILE)
-    if os.path.exists(LOCK_FILE):
-        os.remove(LOCK_FILE)
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
     logger.info("Cleared Meraki API response cache")
 
+# Snapshot opened by this process, if MERAKI_SNAPSHOT is set
+_snapshot = None
+
+def _get_snapshot():
+    global _snapshot
+    path = os.environ.get(SNAPSHOT_ENVIRONMENT_VARIABLE)
+    if not path:
+        return None
+    if _snapshot is None or _snapshot.path != path:
+        _snapshot = Snapshot(path)
+        logger.info(f"Reading Meraki API data from snapshot {path} taken {_snapshot.created}")
+    return _snapshot
+
+def _cache_path(url):
+    """Return the cache file holding the raw response body for url."""
+    return os.path.join(CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
 def _get_request_caching(session, url):
-    if os.path.exists(CACHE_FILE):
-        lock = FileLock(LOCK_FILE)
-        lock.acquire()
-        with open(CACHE_FILE, "r") as f:
-            contents = f.read()
-            cache = json.loads(contents)
-            if url in cache:
-                lock.release()
-                logger.info(f"Returning url {url} result from cache: {cache[url]}")
-                return cache[url]
-        lock.release()
+    snapshot = _get_snapshot()
+    if snapshot is not None:
+        if url in snapshot.skipped:
+            raise Exception(f"url {url} returned {snapshot.skipped[url]} (not applicable) when snapshot {snapshot.path} was taken")
+        if url not in snapshot:
+            raise Exception(f"url {url} is missing from snapshot {snapshot.path}, it was not captured")
+        data = snapshot.get(url)
+        logger.info(f"Returning url {url} result from snapshot: {data}")
+        return data
+    # Each url is cached in its own file with the raw response bytes,
+    # so a hit only decodes that body and a miss never rewrites other entries.
+    path = _cache_path(url)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            data = decode_json(f.read())
+        logger.info(f"Returning url {url} result from cache: {data}")
+        return data
     throttle_request()
     r = request(session, "GET", url)
-    lock = FileLock(LOCK_FILE)
-    lock.acquire()
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r") as f:
-            contents = f.read()
-            cache = json.loads(contents)
-    else:
-        cache = {}
-    rjson = r.json()
-    cache[url] = rjson
-    with open(CACHE_FILE, "w") as f:
-        f.write(json.dumps(cache))
-    lock.release()
-    logger.info(f"Returning url {url} result from a fresh request: {rjson}")
-    return rjson
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # The raw body is stored as-is, without re-encoding.
+    with atomic_write(path, "wb") as f:
+        f.write(r.body)
+    logger.info(f"Returning url {url} result from a fresh request: {r.data}")
+    return r.data
 
 def _get_resource_id(resource, possible_id_props):
     for id_prop in possible_id_props:
@@ -334,7 +351,8 @@ def get_meraki_data(url, resource_names, suite_variable):
     return data
 
 def _get_meraki_data(url, resource_names):
-    session = request_session()
+    # No API access (and so no API key) is needed when reading a snapshot.
+    session = request_session() if _get_snapshot() is None else None
     possible_ids = _possible_id_props_from_url(url)
     api_path = [p.strip("/") for p in re.split(API_PATH_ID_REGEX, url)]
     org_resource = False
@@ -393,38 +411,122 @@ def validate_appliance_per_ssid_settings(api_data, my_data, ssids):
     logger.info(per_ssid_settings)
     return validate_subset(api_data, per_ssid_settings)
 
+# The per-node functions below return their input as is when nothing changes,
+# so that _apply_plan only copies the nodes on the way to a change.
+
 def _map_application_id_to_api(type_value_dict):
+    if type_value_dict.get("type") not in ("application", "applicationCategory"):
+        return type_value_dict
     new_type_value_dict = type_value_dict.copy()
-    if type_value_dict.get("type") in ("application", "applicationCategory"):
-        new_type_value_dict["value"] = {"id": type_value_dict["value"]}
+    new_type_value_dict["value"] = {"id": type_value_dict["value"]}
     return new_type_value_dict
 
 def _map_country_id_to_api(type_value_dict):
+    if type_value_dict.get("type") not in ("blockedCountries", "allowedCountries"):
+        return type_value_dict
     new_type_value_dict = type_value_dict.copy()
-    if type_value_dict.get("type") in ("blockedCountries", "allowedCountries"):
-        new_type_value_dict["value"] = type_value_dict["value_countries"]
-        del new_type_value_dict["value_countries"]
+    new_type_value_dict["value"] = type_value_dict["value_countries"]
+    del new_type_value_dict["value_countries"]
     return new_type_value_dict
 
-def _map_at_path(data, path, func):
-    if isinstance(data, list):
-        return [_map_at_path(item, path, func) for item in data]
+def _compile_plan(transforms):
+    """
+    Compose (path, func) transforms into a single plan.
 
-    if path == "":
-        return func(data)
+    A plan is a list of ops applied in order to a node:
+    a callable op replaces the node with op(node),
+    a (key, plan) op applies plan to node[key].
+    Consecutive transforms below the same key share one (key, plan) op,
+    so they are applied in a single descent.
+    """
 
-    if not isinstance(data, dict):
-        # Nothing at path, so nothing to change - return data as is.
-        return data
+    plan = []
+    for path, func in transforms:
+        _add_to_plan(plan, path.split(".") if path != "" else [], func)
+    return plan
+
+def _add_to_plan(plan, steps, func):
+    if not steps:
+        plan.append(func)
+        return
+    if plan and isinstance(plan[-1], tuple) and plan[-1][0] == steps[0]:
+        _add_to_plan(plan[-1][1], steps[1:], func)
+        return
+    child_plan = []
+    plan.append((steps[0], child_plan))
+    _add_to_plan(child_plan, steps[1:], func)
+
+def _apply_plan(data, plan):
+    """
+    Apply plan to data like applying each of its transforms in turn,
+    in one traversal. Lists are mapped over at every level.
+    Nodes are copied only if something below them changes,
+    unchanged subtrees are shared with data.
+    """
 
-    steps = path.split(".")
-    next_step, further_steps = steps[0], steps[1:]
-    further_path = ".".join(further_steps)
+    if isinstance(data, list):
+        new_data = None
+        for i, item in enumerate(data):
+            new_item = _apply_plan(item, plan)
+            if new_item is not item:
+                if new_data is None:
+                    new_data = list(data)
+                new_data[i] = new_item
+        return data if new_data is None else new_data
+
+    copied = False
+    for i, op in enumerate(plan):
+        if isinstance(data, list):
+            # A previous op returned a list - map the remaining ops over it.
+            return _apply_plan(data, plan[i:])
+        if callable(op):
+            new_data = op(data)
+            if new_data is not data:
+                data = new_data
+                copied = False
+            continue
+        key, child_plan = op
+        if not isinstance(data, dict) or key not in data:
+            # Nothing at path, so nothing to change - keep data as is.
+            continue
+        child = data[key]
+        new_child = _apply_plan(child, child_plan)
+        if new_child is not child:
+            if not copied:
+                data = data.copy()
+                copied = True
+            data[key] = new_child
+    return data
 
-    new_data = data.copy()
-    if next_step in data:
-        new_data[next_step] = _map_at_path(new_data[next_step], further_path, func)
-    return new_data
+def apply_transforms(data, transforms):
+    """
+    Apply several of the YAML-to-API transforms below in a single pass.
+    transforms is a list of dicts (or its Python literal string),
+    each naming the transform and its arguments.
+    The result equals applying the transforms one after another,
+    but data is traversed once and only changed nodes are copied.
+
+    >>> apply_transforms(rules, [
+        {"transform": "map_application_ids_to_api", "path": "rules"},
+        {"transform": "map_country_ids_to_api", "path": "rules"},
+        {"transform": "rename_property", "old_name": "ipv4_address", "new_name": "ipv4", "path": "rules"},
+    ])
+
+    Items may also be (path, func) tuples built by the _*_transform helpers.
+    """
+
+    if isinstance(transforms, str):
+        transforms = eval(transforms)
+    compiled = []
+    for t in transforms:
+        if isinstance(t, dict):
+            kwargs = dict(t)
+            name = kwargs.pop("transform")
+            if name not in _transforms:
+                raise Exception(f"Unknown transform {name}, expected one of {sorted(_transforms)}")
+            t = _transforms[name](**kwargs)
+        compiled.append(t)
+    return _apply_plan(data, _compile_plan(compiled))
 
 def map_application_ids_to_api(data, path=""):
     """
@@ -432,7 +534,10 @@ def map_application_ids_to_api(data, path=""):
     https://github.com/CiscoDevNet/terraform-provider-meraki/blob/5e28e94fb9feaddb7e0e20cceaf848cc565b6ab2/internal/provider/model_meraki_appliance_l7_firewall_rules.go#L74-L81
     """
 
-    return _map_at_path(data, path, _map_application_id_to_api)
+    return apply_transforms(data, [_map_application_ids_to_api_transform(path)])
+
+def _map_application_ids_to_api_transform(path=""):
+    return (path, _map_application_id_to_api)
 
 def map_country_ids_to_api(data, path=""):
     """
@@ -440,7 +545,10 @@ def map_country_ids_to_api(data, path=""):
     https://github.com/CiscoDevNet/terraform-provider-meraki/blob/5e28e94fb9feaddb7e0e20cceaf848cc565b6ab2/internal/provider/model_meraki_appliance_l7_firewall_rules.go#L82-L86
     """
 
-    return _map_at_path(data, path, _map_country_id_to_api)
+    return apply_transforms(data, [_map_country_ids_to_api_transform(path)])
+
+def _map_country_ids_to_api_transform(path=""):
+    return (path, _map_country_id_to_api)
 
 def map_names_to_ids(data, url, parent_names, path="", name_prop="", id_prop=""):
     """
@@ -477,8 +585,12 @@ def map_names_to_ids(data, url, parent_names, path="", name_prop="", id_prop="")
 
     """
 
-    parent_names = eval(parent_names)
-    return _map_at_path(data, path, lambda data: _map_name_to_id(data, url, parent_names, name_prop, id_prop))
+    return apply_transforms(data, [_map_names_to_ids_transform(url, parent_names, path, name_prop, id_prop)])
+
+def _map_names_to_ids_transform(url, parent_names, path="", name_prop="", id_prop=""):
+    if isinstance(parent_names, str):
+        parent_names = eval(parent_names)
+    return (path, lambda data: _map_name_to_id(data, url, parent_names, name_prop, id_prop))
 
 def _map_name_to_id(data, url, parent_names, name_prop, id_prop):
     if name_prop != "":
@@ -520,15 +632,28 @@ def rename_property(data, old_name, new_name, path=""):
     ]
     """
 
-    return _map_at_path(data, path, lambda data: _rename_property(data, old_name, new_name))
+    return apply_transforms(data, [_rename_property_transform(old_name, new_name, path)])
+
+def _rename_property_transform(old_name, new_name, path=""):
+    return (path, lambda data: _rename_property(data, old_name, new_name))
 
 def _rename_property(data, old_name, new_name):
+    if not isinstance(data, dict) or old_name not in data:
+        return data
     new_data = data.copy()
-    if old_name in new_data:
-        new_data[new_name] = new_data[old_name]
-        del new_data[old_name]
+    new_data[new_name] = new_data[old_name]
+    del new_data[old_name]
 
     return new_data
 
+# Transforms usable by name in apply_transforms
+_transforms = {
+    "map_application_ids_to_api": _map_application_ids_to_api_transform,
+    "map_country_ids_to_api": _map_country_ids_to_api_transform,
+    "map_names_to_ids": _map_names_to_ids_transform,
+    "rename_property": _rename_property_transform,
+    "unflatten_dicts_in_property": _unflatten_dicts_in_property_transform,
+}
+
 def clear_meraki_api_cache():
     _delete_cache()
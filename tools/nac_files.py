@@ -0,0 +1,48 @@
+# nac_files.py
+"""
+File helpers shared by the tools in this directory.
+"""
+import contextlib
+import os
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Constants
+YAML_EXTENSIONS = (".yaml", ".yml")
+ENV_TAG = "!env"
+
+def find_yaml_files(paths):
+    """Return the sorted YAML files in paths (files or directories, searched recursively)."""
+
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                files.extend(os.path.join(root, n) for n in names if n.endswith(YAML_EXTENSIONS))
+        else:
+            files.append(p)
+    return sorted(files)
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", permissions=0o644):
+    """
+    Open a private temporary file for writing and rename it to path on success,
+    so concurrent readers never see a partially written file.
+    The file is created with permissions (subject to the umask).
+    """
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, permissions)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,68 @@
+# nac_rules.py
+"""
+Run the custom semantic rules in rules/ against the data/ files locally.
+
+Rules are the same Rule classes nac-validate loads
+(id, description, severity and a match(data, schema=None) classmethod
+returning a list of violations).
+The data is loaded through nac_yaml's parse cache,
+so repeated runs on an unchanged inventory skip YAML parsing.
+Rules see the raw, unrendered merge of the files (see nac_yaml),
+which suits rules on data as written in data/, such as rule 101;
+nac-validate on the rendered model remains the reference check.
+
+    python tools/nac_rules.py -r rules data/
+"""
+import argparse
+import importlib.util
+import os
+import sys
+
+from nac_yaml import CACHE_FILE, load_yaml_files
+
+def load_rules(rules_dir):
+    """Return the Rule classes of the .py files in rules_dir, sorted by id."""
+
+    rules = []
+    for name in sorted(os.listdir(rules_dir)):
+        if not name.endswith(".py"):
+            continue
+        path = os.path.join(rules_dir, name)
+        spec = importlib.util.spec_from_file_location(f"nac_rule_{name[:-3]}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        rule = getattr(module, "Rule", None)
+        if rule is None:
+            raise Exception(f"{path} does not define a Rule class")
+        rules.append(rule)
+    return sorted(rules, key=lambda r: str(r.id))
+
+def run_rules(rules, data):
+    """Return a list of (rule, violations) for every rule with violations."""
+
+    results = []
+    for rule in rules:
+        violations = rule.match(data)
+        if violations:
+            results.append((rule, violations))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run rules/*.py against .nac.yaml files.")
+    parser.add_argument("paths", nargs="+", help="YAML files or directories")
+    parser.add_argument("-r", "--rules", default="rules", help="rules directory (default: rules)")
+    parser.add_argument("--cache-file", default=CACHE_FILE, help=f"parse cache (default: {CACHE_FILE})")
+    parser.add_argument("--no-cache", action="store_true", help="parse every file")
+    args = parser.parse_args(argv)
+
+    rules = load_rules(args.rules)
+    data = load_yaml_files(args.paths, cache_file=None if args.no_cache else args.cache_file)
+    results = run_rules(rules, data)
+    for rule, violations in results:
+        print(f"Semantic error, rule {rule.id} ({rule.severity}): {rule.description}")
+        for v in violations:
+            print(f"    - {v}")
+    return 1 if results else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
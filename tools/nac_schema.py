@@ -0,0 +1,475 @@
+# nac_schema.py
+"""
+Validate .nac.yaml data files against schema.yaml.
+
+schema.yaml uses the Yamale syntax (str(), list(), include(), ...).
+It is compiled once into plain Python check functions,
+and files are then validated in parallel, one file per worker process.
+Validation works on the composed YAML node tree,
+so every error carries the line number it refers to.
+Results are cached by schema and file content hash,
+so unchanged files are not validated again.
+
+Data is split across files, while the schema describes the merged model.
+A required top-level field is therefore only reported as missing
+if no file defines it. Nested required fields are checked per file,
+as list items are not matched up across files.
+
+    python tools/nac_schema.py -s schema.yaml data/
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from nac_files import ENV_TAG, SafeLoader, atomic_write, find_yaml_files
+
+# Constants
+CACHE_FILE = ".nac_schema_cache.json"
+# Bump when the checks change, so cached results are not reused
+VALIDATOR_VERSION = 4
+REQUIRED_MISSING = "Required field missing"
+STR_TAG = "tag:yaml.org,2002:str"
+INT_TAG = "tag:yaml.org,2002:int"
+FLOAT_TAG = "tag:yaml.org,2002:float"
+BOOL_TAG = "tag:yaml.org,2002:bool"
+NULL_TAG = "tag:yaml.org,2002:null"
+# !env values (ENV_TAG) are only known at render time, so they are checked as strings
+
+class SchemaError(Exception):
+    pass
+
+# Used to read int and float scalars with the full YAML 1.1 syntax (0x1A, 1:30, .inf, ...)
+_constructor = yaml.constructor.SafeConstructor()
+_NUMBER_CONSTRUCTORS = {
+    INT_TAG: _constructor.construct_yaml_int,
+    FLOAT_TAG: _constructor.construct_yaml_float,
+}
+
+def _line(node):
+    return node.start_mark.line + 1
+
+def _is_null(node):
+    return isinstance(node, yaml.ScalarNode) and node.tag == NULL_TAG
+
+def _join(path, key):
+    return f"{path}.{key}" if path else str(key)
+
+def _scalar_of(node, tags):
+    return isinstance(node, yaml.ScalarNode) and node.tag in tags
+
+def _check_bounds(node, path, errors, value, min, max, what):
+    if min is not None and value < min:
+        errors.append((_line(node), path, f"{what} is less than {min}"))
+    if max is not None and value > max:
+        errors.append((_line(node), path, f"{what} is greater than {max}"))
+
+def _compile_str(min=None, max=None, exclude=None):
+    def check(node, path, errors):
+        if _scalar_of(node, (ENV_TAG,)):
+            return
+        if not _scalar_of(node, (STR_TAG,)):
+            errors.append((_line(node), path, f"'{_repr(node)}' is not a str"))
+            return
+        _check_bounds(node, path, errors, len(node.value), min, max, "Length")
+        if exclude and any(c in node.value for c in exclude):
+            errors.append((_line(node), path, f"'{node.value}' contains excluded character"))
+    return check
+
+def _compile_number(tags, name):
+    def compile(min=None, max=None):
+        def check(node, path, errors):
+            if _scalar_of(node, (ENV_TAG,)):
+                return
+            if not _scalar_of(node, tags):
+                errors.append((_line(node), path, f"'{_repr(node)}' is not a {name}"))
+                return
+            try:
+                value = _NUMBER_CONSTRUCTORS[node.tag](node)
+            except (ValueError, IndexError):
+                # IndexError for empty scalars tagged !!int or !!float
+                errors.append((_line(node), path, f"'{node.value}' is not a valid {name}"))
+                return
+            _check_bounds(node, path, errors, value, min, max, "Value")
+        return check
+    return compile
+
+def _compile_bool():
+    def check(node, path, errors):
+        if not _scalar_of(node, (BOOL_TAG, ENV_TAG)):
+            errors.append((_line(node), path, f"'{_repr(node)}' is not a bool"))
+    return check
+
+def _compile_enum(*values):
+    allowed = {str(v) for v in values}
+    def check(node, path, errors):
+        if _scalar_of(node, (ENV_TAG,)):
+            return
+        if not isinstance(node, yaml.ScalarNode) or node.value not in allowed:
+            errors.append((_line(node), path, f"'{_repr(node)}' not in {list(values)}"))
+    return check
+
+def _compile_any(*validators):
+    if not validators:
+        return lambda node, path, errors: None
+    return _first_match(validators)
+
+def _compile_list(*validators, min=None, max=None):
+    item_check = _first_match(validators) if validators else None
+    def check(node, path, errors):
+        if not isinstance(node, yaml.SequenceNode):
+            errors.append((_line(node), path, f"'{_repr(node)}' is not a list"))
+            return
+        _check_bounds(node, path, errors, len(node.value), min, max, "Length")
+        if item_check is None:
+            return
+        for i, item in enumerate(node.value):
+            item_check(item, _join(path, i), errors)
+    return check
+
+def _compile_map(*validators, key=None):
+    value_check = _first_match(validators) if validators else None
+    def check(node, path, errors):
+        if not isinstance(node, yaml.MappingNode):
+            errors.append((_line(node), path, f"'{_repr(node)}' is not a map"))
+            return
+        for k, v in node.value:
+            if key is not None:
+                key(k, _join(path, k.value), errors)
+            if value_check is not None:
+                value_check(v, _join(path, k.value), errors)
+    return check
+
+def _first_match(validators):
+    """
+    Return a check that passes if any of validators passes.
+    With a single validator its own errors are reported as is.
+    """
+
+    if len(validators) == 1:
+        return validators[0]
+
+    def check(node, path, errors):
+        for validator in validators:
+            attempt = []
+            validator(node, path, attempt)
+            if not attempt:
+                return
+        errors.append((_line(node), path, f"'{_repr(node)}' does not match any of the allowed types"))
+    return check
+
+def _repr(node):
+    if isinstance(node, yaml.ScalarNode):
+        return node.value
+    if isinstance(node, yaml.SequenceNode):
+        return "list"
+    return "map"
+
+_VALIDATORS = {
+    "str": _compile_str,
+    "int": _compile_number((INT_TAG,), "int"),
+    "num": _compile_number((INT_TAG, FLOAT_TAG), "num"),
+    "bool": _compile_bool,
+    "enum": _compile_enum,
+    "any": _compile_any,
+    "list": _compile_list,
+    "map": _compile_map,
+}
+
+class _Compiler:
+    """
+    Compile a Yamale schema into check functions.
+
+    Every check has the signature check(node, path, errors)
+    and appends (line, path, message) tuples to errors.
+    Includes are compiled once per strictness and shared between all references.
+    """
+
+    def __init__(self, strict):
+        self.strict = strict
+        self.include_fields = {}
+        self.includes = {}
+        self.references = []
+
+    def compile(self, schema_text):
+        docs = [d for d in yaml.safe_load_all(schema_text) if d is not None]
+        if not docs:
+            raise SchemaError("schema is empty")
+        for doc in docs[1:]:
+            if not isinstance(doc, dict):
+                raise SchemaError("includes must be a map of names to fields")
+            self.include_fields.update(doc)
+        root = self.compile_mapping(docs[0], "<root>", self.strict)
+        # Compiling an include may reference further includes.
+        i = 0
+        while i < len(self.references):
+            name, strict, where = self.references[i]
+            i += 1
+            if (name, strict) in self.includes:
+                continue
+            if name not in self.include_fields:
+                raise SchemaError(f"{where}: include('{name}') is not defined")
+            # Placeholder first, so recursive references stop here.
+            self.includes[(name, strict)] = None
+            self.includes[(name, strict)] = self.compile_mapping(self.include_fields[name], name, strict)
+        return root
+
+    def compile_mapping(self, fields, where, strict):
+        if not isinstance(fields, dict):
+            raise SchemaError(f"{where}: expected a map of fields")
+        compiled = {}
+        for name, expr in fields.items():
+            compiled[str(name)] = self.compile_field(expr, f"{where}.{name}", strict)
+
+        def check(node, path, errors):
+            if not isinstance(node, yaml.MappingNode):
+                errors.append((_line(node), path, f"'{_repr(node)}' is not a map"))
+                return
+            present = {k.value: v for k, v in node.value}
+            for name, (field_check, required, none) in compiled.items():
+                value = present.get(name)
+                if value is None or _is_null(value):
+                    if required:
+                        line = _line(value) if value is not None else _line(node)
+                        errors.append((line, _join(path, name), REQUIRED_MISSING))
+                    elif value is not None and not none:
+                        errors.append((_line(value), _join(path, name), "Value must not be null"))
+                    continue
+                field_check(value, _join(path, name), errors)
+            if strict:
+                for k, _ in node.value:
+                    if k.value not in compiled:
+                        errors.append((_line(k), _join(path, k.value), "Unexpected element"))
+        return check
+
+    def compile_field(self, expr, where, strict):
+        """Return (check, required, none) for a field's schema expression."""
+
+        if isinstance(expr, dict):
+            return self.compile_mapping(expr, where, strict), True, True
+        if not isinstance(expr, str):
+            raise SchemaError(f"{where}: invalid schema expression {expr!r}")
+        try:
+            tree = ast.parse(expr.strip(), mode="eval").body
+        except SyntaxError as e:
+            raise SchemaError(f"{where}: invalid schema expression {expr!r}: {e}")
+        return self.compile_call(tree, where, strict)
+
+    def compile_argument(self, tree, where, strict):
+        if isinstance(tree, ast.Call):
+            return self.compile_call(tree, where, strict)[0]
+        try:
+            return ast.literal_eval(tree)
+        except (ValueError, SyntaxError):
+            raise SchemaError(f"{where}: argument {ast.unparse(tree)!r} is not a literal (missing quotes?)")
+
+    def compile_call(self, tree, where, strict):
+        """
+        Return (check, required, none) for a validator call.
+        required and none (allow null for optional fields, default True)
+        are accepted by every validator, strict only by include().
+        """
+
+        if not isinstance(tree, ast.Call) or not isinstance(tree.func, ast.Name):
+            raise SchemaError(f"{where}: expected a validator call, got {ast.unparse(tree)!r}")
+        name = tree.func.id
+        args = [self.compile_argument(a, where, strict) for a in tree.args]
+        kwargs = {kw.arg: self.compile_argument(kw.value, where, strict) for kw in tree.keywords}
+        required = kwargs.pop("required", True)
+        none = kwargs.pop("none", True)
+
+        if name == "include":
+            include_strict = kwargs.pop("strict", strict)
+            if kwargs or len(args) != 1 or not isinstance(args[0], str):
+                raise SchemaError(f"{where}: include() takes one include name and optional required, none and strict")
+            return self.compile_include(args[0], where, include_strict), required, none
+        if name not in _VALIDATORS:
+            raise SchemaError(f"{where}: unknown validator {name}()")
+        try:
+            return _VALIDATORS[name](*args, **kwargs), required, none
+        except TypeError as e:
+            raise SchemaError(f"{where}: {name}(): {e}")
+
+    def compile_include(self, name, where, strict):
+        includes = self.includes
+        self.references.append((name, strict, where))
+
+        # Resolved at validation time, as includes may be defined after use
+        # or refer to each other recursively.
+        def check(node, path, errors):
+            includes[(name, strict)](node, path, errors)
+        return check
+
+def compile_schema(schema_text, strict=False):
+    """
+    Compile schema_text into a check(node, path, errors) function
+    for the root of a data document.
+    """
+
+    return _Compiler(strict).compile(schema_text)
+
+def validate_node(check, node):
+    """Return a sorted list of (line, path, message) for a composed document."""
+
+    errors = []
+    check(node, "", errors)
+    return sorted(set(errors))
+
+def validate_file(check, path):
+    """Return a sorted list of (line, path, message) for every document in a file."""
+
+    errors = []
+    try:
+        with open(path, "rb") as f:
+            for node in yaml.compose_all(f, Loader=SafeLoader):
+                if node is not None:
+                    errors.extend(validate_node(check, node))
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        line = mark.line + 1 if mark else 0
+        errors.append((line, "", f"YAML parse error: {e.problem or e}"))
+    except yaml.YAMLError as e:
+        # E.g. a ReaderError for invalid UTF-8, which carries no line mark.
+        message = " ".join(str(e).split())
+        errors.append((0, "", f"YAML parse error: {message}"))
+    return errors
+
+# Each worker process compiles the schema once on startup.
+_worker_check = None
+
+def _init_worker(schema_text, strict):
+    global _worker_check
+    _worker_check = compile_schema(schema_text, strict)
+
+def _validate_in_worker(path):
+    return path, validate_file(_worker_check, path)
+
+def _cache_key(schema_hash, strict, path):
+    with open(path, "rb") as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+    return f"{VALIDATOR_VERSION}:{schema_hash}:{int(strict)}:{content_hash}"
+
+def _load_cache(cache_file):
+    """Return the cache as {key: {"path": absolute file path, "errors": [...]}}."""
+
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r") as f:
+                cache = json.load(f)
+        except ValueError:
+            return {}
+        if isinstance(cache, dict):
+            return {k: v for k, v in cache.items() if isinstance(v, dict) and "path" in v and "errors" in v}
+    return {}
+
+def _prune_cache(cache, keys):
+    """
+    Drop entries of files that were removed, or that were validated
+    in this run under a different key (changed content, schema or options).
+    Entries of files outside this run are kept.
+    """
+
+    current = {os.path.abspath(path): key for path, key in keys.items()}
+    return {
+        k: v for k, v in cache.items()
+        if current.get(v["path"], k) == k and os.path.exists(v["path"])
+    }
+
+def _save_cache(cache_file, cache):
+    with atomic_write(cache_file) as f:
+        json.dump(cache, f)
+
+def validate_paths(schema_path, paths, strict=False, jobs=None, cache_file=CACHE_FILE):
+    """
+    Validate all YAML files under paths against the schema at schema_path.
+    Return a dict of file path to a list of (line, path, message).
+    Files whose content and schema are unchanged since a previous run
+    are answered from cache_file (pass None to disable caching).
+    """
+
+    with open(schema_path, "r") as f:
+        schema_text = f.read()
+    # Compile in the main process first so schema errors surface once.
+    compile_schema(schema_text, strict)
+    schema_hash = hashlib.sha256(schema_text.encode()).hexdigest()
+
+    cache = _load_cache(cache_file)
+    results = {}
+    keys = {}
+    pending = []
+    for path in find_yaml_files(paths):
+        keys[path] = _cache_key(schema_hash, strict, path)
+        if keys[path] in cache:
+            results[path] = [tuple(e) for e in cache[keys[path]]["errors"]]
+        else:
+            pending.append(path)
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(pending) <= 1:
+        _init_worker(schema_text, strict)
+        for path, errors in map(_validate_in_worker, pending):
+            results[path] = errors
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending)),
+                                 initializer=_init_worker,
+                                 initargs=(schema_text, strict)) as pool:
+            for path, errors in pool.map(_validate_in_worker, pending):
+                results[path] = errors
+
+    if cache_file:
+        for path in pending:
+            cache[keys[path]] = {"path": os.path.abspath(path), "errors": results[path]}
+        pruned = _prune_cache(cache, keys)
+        if pending or len(pruned) != len(cache):
+            _save_cache(cache_file, pruned)
+
+    return _merge_required_top_level(dict(sorted(results.items())))
+
+def _merge_required_top_level(results):
+    """
+    Drop "Required field missing" errors for top-level fields
+    that at least one of the files defines.
+    """
+
+    missing_in = {}
+    for path, errors in results.items():
+        for _, where, message in errors:
+            if message == REQUIRED_MISSING and "." not in where:
+                missing_in.setdefault(where, set()).add(path)
+    provided = {where for where, paths in missing_in.items() if len(paths) < len(results)}
+    return {
+        path: [e for e in errors if not (e[2] == REQUIRED_MISSING and e[1] in provided)]
+        for path, errors in results.items()
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate .nac.yaml files against a Yamale schema.")
+    parser.add_argument("paths", nargs="+", help="YAML files or directories")
+    parser.add_argument("-s", "--schema", default="schema.yaml", help="schema file (default: schema.yaml)")
+    parser.add_argument("--strict", action="store_true", help="report keys not defined in the schema")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--cache-file", default=CACHE_FILE, help=f"result cache (default: {CACHE_FILE})")
+    parser.add_argument("--no-cache", action="store_true", help="validate every file")
+    args = parser.parse_args(argv)
+
+    try:
+        results = validate_paths(args.schema, args.paths, strict=args.strict, jobs=args.jobs,
+                                 cache_file=None if args.no_cache else args.cache_file)
+    except SchemaError as e:
+        print(f"{args.schema}: {e}", file=sys.stderr)
+        return 2
+
+    failed = False
+    for path, errors in results.items():
+        for line, where, message in errors:
+            failed = True
+            print(f"{path}:{line}: {where + ': ' if where else ''}{message}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
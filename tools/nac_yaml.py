@@ -0,0 +1,227 @@
+# nac_yaml.py
+"""
+Load .nac.yaml data files with !env resolution and a persistent parse cache.
+
+Files are parsed with the C-accelerated PyYAML loader when available.
+Every parsed file is kept in a single cache keyed by path,
+mtime/size and content hash. When none of those changed,
+loading a data directory is a stat() per file plus one unmarshal,
+instead of a full YAML parse.
+
+!env tags are kept unresolved in the cache and resolved on every load,
+so no environment values (secrets included) are written to disk
+and changing an environment variable needs no re-parse.
+The cache is plain marshal data created with mode 0600.
+
+The result is a raw merge of the files: branch templates are not rendered
+(templates:, variables: and ${...} placeholders are kept as they are)
+and lists are concatenated, whereas the Terraform model module merges
+list items sharing the same key. It is not a substitute for
+workspaces/merged_configuration.nac.yaml.
+
+Used by nac_rules.py to run rules/*.py locally; it can also be run on its own:
+
+    python tools/nac_yaml.py data/ -o raw.nac.yaml
+"""
+import argparse
+import hashlib
+import marshal
+import os
+import sys
+
+import yaml
+
+from nac_files import ENV_TAG, SafeLoader, atomic_write, find_yaml_files
+
+# Constants
+CACHE_FILE = ".nac_yaml_cache"
+CACHE_MAGIC = "nac_yaml"
+CACHE_VERSION = 2
+
+class EnvLoader(SafeLoader):
+    """
+    Safe loader keeping !env <NAME> as an (ENV_TAG, NAME) tuple,
+    which plain YAML data never contains, for resolution on load.
+    Timestamps are kept as strings, as the Terraform YAML decoder does.
+    """
+
+def _construct_env(loader, node):
+    return (ENV_TAG, loader.construct_scalar(node))
+
+EnvLoader.add_constructor(ENV_TAG, _construct_env)
+EnvLoader.add_constructor("tag:yaml.org,2002:timestamp", SafeLoader.construct_yaml_str)
+
+def _is_env_ref(value):
+    return isinstance(value, tuple) and len(value) == 2 and value[0] == ENV_TAG
+
+def parse_yaml(content):
+    """
+    Parse YAML content (bytes or str) with !env left unresolved.
+    Return (data, env_refs) where env_refs lists (path, name)
+    for every !env value; multi-document content is merged in order.
+    """
+
+    loader = EnvLoader(content)
+    try:
+        data = None
+        while loader.check_data():
+            data = merge(data, loader.get_data())
+    finally:
+        loader.dispose()
+    env_refs = []
+    _find_env_refs(data, (), env_refs)
+    return data, env_refs
+
+def _find_env_refs(data, path, env_refs):
+    if _is_env_ref(data):
+        env_refs.append((path, data[1]))
+    elif isinstance(data, dict):
+        for k, v in data.items():
+            _find_env_refs(v, path + (k,), env_refs)
+    elif isinstance(data, list):
+        for i, v in enumerate(data):
+            _find_env_refs(v, path + (i,), env_refs)
+
+def resolve_env(data, env_refs):
+    """
+    Return data with the !env values at env_refs replaced by the
+    environment variable values (None if not set).
+    Only the containers on the way to an !env value are copied.
+    """
+
+    if not env_refs:
+        return data
+    tree = {}
+    for path, name in env_refs:
+        if not path:
+            return os.environ.get(name)
+        node = tree
+        for step in path[:-1]:
+            node = node.setdefault(step, {})
+        node[path[-1]] = name
+    return _resolve_tree(data, tree)
+
+def _resolve_tree(data, tree):
+    data = data.copy() if isinstance(data, dict) else list(data)
+    for step, sub in tree.items():
+        data[step] = os.environ.get(sub) if isinstance(sub, str) else _resolve_tree(data[step], sub)
+    return data
+
+def merge(base, other):
+    """
+    Return other merged into base: dicts are merged recursively,
+    lists are concatenated and other scalars replace base.
+    Neither argument is modified.
+    """
+
+    if base is None:
+        return other
+    if other is None:
+        return base
+    if isinstance(base, dict) and isinstance(other, dict):
+        merged = dict(base)
+        for k, v in other.items():
+            merged[k] = merge(base[k], v) if k in base else v
+        return merged
+    if isinstance(base, list) and isinstance(other, list):
+        return base + other
+    return other
+
+class YamlCache:
+    """
+    Persistent cache of parsed YAML files.
+
+    Entries are stored as {path: (mtime_ns, size, sha256, env_refs, data)}
+    with !env values unresolved.
+    An entry is reused without reading the file if mtime and size match,
+    or after reading and hashing it if only the mtime changed.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.dirty = False
+        if cache_file and os.path.exists(cache_file):
+            self.entries = _read_cache(cache_file)
+
+    def load(self, path):
+        """Return the data of the file at path with !env resolved."""
+
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return resolve_env(entry[4], entry[3])
+
+        with open(path, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        if entry is not None and entry[2] == digest:
+            data, env_refs = entry[4], entry[3]
+        else:
+            data, env_refs = parse_yaml(content)
+        self.entries[path] = (st.st_mtime_ns, st.st_size, digest, env_refs, data)
+        self.dirty = True
+        return resolve_env(data, env_refs)
+
+    def save(self):
+        if not self.cache_file or not self.dirty:
+            return
+        # Drop entries of files that no longer exist or cannot be marshalled.
+        entries = {p: e for p, e in self.entries.items() if os.path.exists(p) and _marshallable(e)}
+        with atomic_write(self.cache_file, "wb", permissions=0o600) as f:
+            marshal.dump((CACHE_MAGIC, CACHE_VERSION, tuple(sys.version_info[:2]), entries), f)
+        self.dirty = False
+
+def _read_cache(cache_file):
+    # marshal only builds plain data, it cannot run code while loading.
+    try:
+        with open(cache_file, "rb") as f:
+            magic, version, python, entries = marshal.load(f)
+    except (OSError, ValueError, EOFError, TypeError):
+        return {}
+    if magic != CACHE_MAGIC or version != CACHE_VERSION \
+            or python != tuple(sys.version_info[:2]) or not isinstance(entries, dict):
+        return {}
+    return entries
+
+def _marshallable(entry):
+    try:
+        marshal.dumps(entry)
+        return True
+    except ValueError:
+        return False
+
+def load_yaml_files(paths, cache_file=CACHE_FILE):
+    """
+    Load and merge all YAML files under paths (files or directories)
+    in sorted path order, using the parse cache in cache_file
+    (pass None to disable it). Return the merged data as a dict.
+    """
+
+    cache = YamlCache(cache_file)
+    data = {}
+    for path in find_yaml_files(paths):
+        data = merge(data, cache.load(path))
+    cache.save()
+    return data
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load and merge .nac.yaml files (unrendered) with !env resolution.")
+    parser.add_argument("paths", nargs="+", help="YAML files or directories")
+    parser.add_argument("-o", "--output", help="write the merged data to this file (default: stdout)")
+    parser.add_argument("--cache-file", default=CACHE_FILE, help=f"parse cache (default: {CACHE_FILE})")
+    parser.add_argument("--no-cache", action="store_true", help="parse every file")
+    args = parser.parse_args(argv)
+
+    data = load_yaml_files(args.paths, cache_file=None if args.no_cache else args.cache_file)
+    Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    if args.output:
+        with open(args.output, "w") as f:
+            yaml.dump(data, f, Dumper=Dumper, sort_keys=False, allow_unicode=True)
+    else:
+        yaml.dump(data, sys.stdout, Dumper=Dumper, sort_keys=False, allow_unicode=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())